@@ -1,37 +1,219 @@
 from pyramid.httpexceptions import HTTPFound
+from pyramid.renderers import render
 from pyramid.security import Allow, Everyone
+from pyramid.settings import asbool
 from pyramid.view import view_config
+import sqlalchemy as sa
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.pool import Pool
 from sqlalchemy.orm.mapper import _mapper_registry
 import transaction
 import tw2.sqla as tws
 import tw2.core as twc
+import datetime
+import hashlib
 import inspect
+import itertools
 import os
+import sqlite3
+import threading
+import time
+
+from .widgets import AutocompleteField
 
 
 _marker = object()
 AVAILABLE_OBJECTS = _marker
+DEFAULT_DB = 'default'
+
+
+def get_db_name(cls):
+    """Get the name of the database of the given class.
+
+    It's the `__sqladmin_db__` attribute, generally set on the declarative
+    base, or DEFAULT_DB.
+    """
+    return getattr(cls, '__sqladmin_db__', DEFAULT_DB)
 
-def get_mapped_classes():
-    """Get all the SQLAlchemy mapped classes
+
+def get_databases():
+    """Get all the SQLAlchemy mapped classes grouped by database
     """
     global AVAILABLE_OBJECTS
     if AVAILABLE_OBJECTS is not _marker:
         return AVAILABLE_OBJECTS
 
-    AVAILABLE_OBJECTS = {}
+    # Only publish the registry once complete: a concurrent request can read
+    # it while we fill it.
+    databases = {}
     for m in _mapper_registry:
-        AVAILABLE_OBJECTS[m.class_.__name__.lower()] = m.class_
+        classes = databases.setdefault(get_db_name(m.class_), {})
+        classes[m.class_.__name__.lower()] = m.class_
+    AVAILABLE_OBJECTS = databases
     return AVAILABLE_OBJECTS
 
 
-def get_class(class_name):
-    """Get the class according to the given class name.
+def get_mapped_classes(db=None):
+    """Get the SQLAlchemy mapped classes of the given database, or all of
+    them if db is None.
     """
-    classes = get_mapped_classes()
+    databases = get_databases()
+    if db is not None:
+        return databases.get(db, {})
+    classes = {}
+    for db_classes in databases.values():
+        classes.update(db_classes)
+    return classes
+
+
+def get_class(class_name, db=None):
+    """Get the class according to the given class name and database.
+    """
+    classes = get_mapped_classes(db)
     return classes.get(class_name)
 
 
+def route_kw(request, cls):
+    """Get the route parameters to make an url for the given class.
+    """
+    kw = {'classname': cls.__name__.lower()}
+    if 'db' in request.matchdict:
+        kw['db'] = get_db_name(cls)
+    return kw
+
+
+def get_label_column(cls):
+    """Get the column used to lookup the objects of the given class.
+
+    It's the attribute named by `__sqladmin_label__` if defined, else the
+    first string column which is not a primary key, else the primary key.
+    """
+    label = getattr(cls, '__sqladmin_label__', None)
+    if label:
+        return getattr(cls, label)
+    mapper = class_mapper(cls)
+    for column in mapper.local_table.columns:
+        if not column.primary_key and isinstance(column.type, sa.String):
+            return getattr(cls, mapper.get_property_by_column(column).key)
+    return getattr(cls, cls._pk_name())
+
+
+def get_version_column(cls):
+    """Get the column telling when the objects of the given class have
+    changed: the mapper version column or the `updated_at` column.
+    """
+    mapper = class_mapper(cls)
+    if mapper.version_id_col is not None:
+        prop = mapper.get_property_by_column(mapper.version_id_col)
+        return getattr(cls, prop.key)
+    if mapper.has_property('updated_at'):
+        return cls.updated_at
+    return None
+
+
+def is_not_modified(request, version, *values):
+    """Set the ETag and Last-Modified headers computed from the given version
+    and values on the response, and tell if the client already has it.
+    """
+    response = request.response
+    response.etag = hashlib.md5(repr((version,) + values)).hexdigest()
+    if isinstance(version, datetime.datetime):
+        response.last_modified = version
+    response.cache_control = 'private, no-cache'
+
+    if request.if_none_match:
+        return response.etag in request.if_none_match
+    if response.last_modified and request.if_modified_since:
+        return response.last_modified <= request.if_modified_since
+    return False
+
+
+def not_modified_response(request):
+    response = request.response
+    response.status_int = 304
+    return response
+
+
+# The seconds during which the size of a related table is cached
+LARGE_TABLE_TTL = 60
+
+# (expiration time, is large) by (class, threshold)
+_large_tables = {}
+
+
+def is_large_table(cls, threshold):
+    """Tell if the table of cls has more rows than threshold.
+
+    note:: The answer is cached for LARGE_TABLE_TTL seconds, so a table
+    growing past the threshold is seen without counting it on every request.
+    """
+    key = (cls, threshold)
+    now = time.time()
+    cached = _large_tables.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    # Only count up to threshold + 1 rows to keep the query cheap
+    large = cls.query.limit(threshold + 1).count() > threshold
+    _large_tables[key] = (now + LARGE_TABLE_TTL, large)
+    return large
+
+
+def get_autocomplete_widgets(cls, request):
+    """Get the autocomplete widgets by property key of the many-to-one
+    relations of cls which target a table with more rows than the
+    autocomplete threshold.
+    """
+    props = [p for p in class_mapper(cls).iterate_properties
+             if tws.utils.is_manytoone(p)]
+    if not props:
+        return {}
+    threshold = get_setting(request.registry.settings,
+                            'autocomplete_threshold')
+    widgets = {}
+    for prop in props:
+        if prop.info.get('edit_widget'):
+            # Don't override a widget defined by the user
+            continue
+        related = prop.mapper.class_
+        if not is_large_table(related, threshold):
+            continue
+        widgets[prop.key] = AutocompleteField(
+            id=prop.key,
+            entity=related,
+            label_key=get_label_column(related).key,
+            required=tws.factory.required_widget(prop),
+            lookup_url=request.route_path('admin_lookup',
+                                          **route_kw(request, related)))
+    return widgets
+
+
+def get_edit_form(cls, request):
+    """Get the edit form of cls, using an autocomplete widget for the large
+    many-to-one relations.
+
+    note:: The autocomplete widgets are given by the policy of a form class
+    built for the request: the mapper of cls, shared with the application
+    forms, is left untouched.
+    """
+    widgets = get_autocomplete_widgets(cls, request)
+    if not widgets:
+        return cls.edit_form()
+
+    class AutocompletePolicy(tws.EditPolicy):
+
+        @classmethod
+        def factory(policy, prop):
+            widget = widgets.get(prop.key)
+            if widget is None:
+                widget = super(AutocompletePolicy, policy).factory(prop)
+            return widget
+
+    form_cls = type('%sAutoTableForm' % cls.__name__,
+                    (tws.AutoTableForm,),
+                    {'entity': cls, 'policy': AutocompletePolicy})
+    return form_cls().req()
+
+
 # Request helpers
 def get_obj(info):
     """Get the object corresponding to the request
@@ -40,7 +222,7 @@ def get_obj(info):
     ident = info['match']['id']
     if not class_name or not ident:
         return None
-    cls = get_class(class_name)
+    cls = get_class(class_name, info['match'].get('db'))
     if not cls:
         return None
     obj = cls.query.get(ident)
@@ -68,7 +250,7 @@ def exist_class(info, request):
     coherent with :function `exist_object`
     """
     classname = info['match']['classname']
-    cls = get_class(classname)
+    cls = get_class(classname, info['match'].get('db'))
     if not cls:
         return False
 
@@ -77,6 +259,77 @@ def exist_class(info, request):
 
 
 
+ROWS_MARKER = '<!-- sqladmin rows -->'
+
+
+def get_grid_cls(cls):
+    return type('%sAutoViewGrid' % cls.__name__,
+                (tws.AutoViewGrid,),
+                {'entity': cls})
+
+
+def stream_list(cls, request, query, notice=None):
+    """Get a response streaming the list of the objects of cls returned by
+    query.
+
+    The objects are fetched and rendered by batch, so only one batch of rows
+    is in memory at a time.
+    """
+    batch_size = get_setting(request.registry.settings, 'stream_batch_size')
+    grid_cls = get_grid_cls(cls)
+    objs = iter(query.yield_per(batch_size))
+
+    def iter_batches():
+        # The rows are numbered across the batches, like in a single grid, so
+        # their ids are unique and their classes alternate.
+        grid = grid_cls().req()
+        index = 0
+        while True:
+            batch = list(itertools.islice(objs, batch_size))
+            if not batch:
+                return
+            rows = []
+            for obj in batch:
+                row_cls = grid_cls.child(parent=grid_cls, repetition=index)
+                row = row_cls.req(parent=grid)
+                row.value = obj
+                row.prepare()
+                rows.append(row)
+                index += 1
+            yield rows
+
+    # An empty row gives the labels of the columns, even without objects
+    row = grid_cls.child.req(repetition=0)
+    row.prepare()
+    labels = [c.label for c in row.children_non_hidden]
+
+    html = render('sqladmin/list.mak',
+                  {'labels': labels, 'rows': ROWS_MARKER, 'notice': notice},
+                  request=request)
+    head, tail = html.split(ROWS_MARKER)
+
+    # The tw2 middleware clears its request local storage before the body is
+    # iterated, the widgets need it to be displayed.
+    local = dict(twc.core.request_local())
+
+    def app_iter():
+        twc.core.request_local().update(local)
+        try:
+            yield head.encode('utf-8')
+            for rows in iter_batches():
+                html = u''.join(row.display() for row in rows)
+                yield html.encode('utf-8')
+            yield tail.encode('utf-8')
+        finally:
+            twc.core.request_local().clear()
+
+    response = request.response
+    response.content_type = 'text/html'
+    response.charset = 'utf-8'
+    response.app_iter = app_iter()
+    return response
+
+
 # We need an object to set the permission for the sqladmin home page
 class HomeFactory(object): pass
 
@@ -92,45 +345,193 @@ def admin_factory(request):
 
 
 
+# Query guards
+class QueryLimitExceeded(Exception):
+    """Raised when an admin request exceeds the statement timeout.
+    """
+
+
+def set_statement_timeout(cls, request, timeout):
+    """Interrupt the queries made on the database of cls after timeout
+    seconds.
+    """
+    connection = cls.query.session.connection(mapper=class_mapper(cls))
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.execute(
+            'SET LOCAL statement_timeout = %d' % (timeout * 1000))
+    elif dialect == 'sqlite':
+        fairy = connection.connection
+        # Keep the sqlite3 connection: the pool wrapper loses it when released
+        dbapi_connection = fairy.connection
+        deadline = time.time() + timeout
+        thread = threading.current_thread()
+
+        def progress_handler():
+            # A non zero value interrupts the query. Once released, the
+            # connection can be used by another thread: don't interrupt it.
+            return (threading.current_thread() is thread
+                    and time.time() > deadline)
+
+        def remove_progress_handler(request):
+            try:
+                dbapi_connection.set_progress_handler(None, 1000)
+            except sqlite3.ProgrammingError:
+                # The connection has been closed with the progress handler
+                pass
+
+        dbapi_connection.set_progress_handler(progress_handler, 1000)
+        fairy.info[PROGRESS_HANDLER_KEY] = True
+        request.add_finished_callback(remove_progress_handler)
+
+
+# Set in the info of the SQLite connections which have a progress handler
+PROGRESS_HANDLER_KEY = 'sqladmin_progress_handler'
+
+
+def checkin_progress_handler(dbapi_connection, connection_record):
+    """Remove the progress handler of a SQLite connection returned to the
+    pool, before it's used by another request.
+    """
+    if not connection_record.info.pop(PROGRESS_HANDLER_KEY, False):
+        return
+    if dbapi_connection is not None:
+        dbapi_connection.set_progress_handler(None, 1000)
+
+sa.event.listen(Pool, 'checkin', checkin_progress_handler)
+
+
+def is_timeout_error(e):
+    msg = str(e.orig)
+    return 'interrupted' in msg or 'statement timeout' in msg
+
+
+def get_list_query(cls, request):
+    """Get the query of the list of cls, limited to the max_rows setting, and
+    a notice telling when it's truncated.
+    """
+    max_rows = get_setting(request.registry.settings, 'max_rows')
+    if not max_rows:
+        return cls.query, None
+    notice = None
+    # Only count up to max_rows + 1 rows to keep the query cheap
+    if cls.query.limit(max_rows + 1).count() > max_rows:
+        notice = 'Only the first %s %s are displayed' % (max_rows,
+                                                         cls.__name__)
+    return cls.query.limit(max_rows), notice
+
+
+def query_guard(view):
+    """Apply the statement timeout to the queries made by the view.
+    """
+    def wrapper(context, request):
+        timeout = get_setting(request.registry.settings, 'statement_timeout')
+        if not timeout or not hasattr(context, 'query'):
+            return view(context, request)
+        cls = context if inspect.isclass(context) else type(context)
+        set_statement_timeout(cls, request, timeout)
+        try:
+            return view(context, request)
+        except sa.exc.OperationalError, e:
+            if not is_timeout_error(e):
+                raise
+            transaction.abort()
+            raise QueryLimitExceeded(
+                'The request took more than %s seconds' % timeout)
+    return wrapper
+
+
+
 # Views
 @view_config(
     route_name='admin_home',
     permission='sqladmin',
+    decorator=query_guard,
     renderer='sqladmin/home.mak')
 def home(request):
     """Display all the editable classes
     """
     links = []
-    for name, cls in get_mapped_classes().items():
-        links += [(cls.__name__, request.route_url('admin_list', classname=name))]
+    if get_setting(request.registry.settings, 'multi_db'):
+        for db, classes in get_databases().items():
+            for name, cls in classes.items():
+                url = request.route_url('admin_list', db=db, classname=name)
+                links += [('%s.%s' % (db, cls.__name__), url)]
+    else:
+        for name, cls in get_mapped_classes().items():
+            links += [(cls.__name__, request.route_url('admin_list', classname=name))]
     return {'links': links}
 
 
 @view_config(
     route_name='admin_list',
     permission='sqladmin',
+    decorator=query_guard,
     renderer='sqladmin/default.mak')
 def admin_list(context, request):
     """Display all the objects in the DB for a given class.
     """
+    column = get_version_column(context)
+    if column is not None:
+        # The version counters only increase so their sum changes on every
+        # update, unlike their max
+        if class_mapper(context).version_id_col is not None:
+            func = sa.func.sum
+        else:
+            func = sa.func.max
+        aggregates = [func(column), sa.func.count()]
+        # A deleted row replaced by a new one can leave the version and the
+        # count unchanged, not the primary keys
+        for pk in class_mapper(context).primary_key:
+            if isinstance(pk.type, sa.Integer):
+                aggregates.append(sa.func.sum(pk))
+            aggregates.append(sa.func.max(pk))
+        values = context.query.with_entities(*aggregates).one()
+        if is_not_modified(request, values[0], context.__name__,
+                           *values[1:]):
+            return not_modified_response(request)
+
+    settings = request.registry.settings
+    query, notice = get_list_query(context, request)
+    if get_setting(settings, 'stream_list'):
+        return stream_list(context, request, query, notice)
+
+    if not get_setting(settings, 'max_rows'):
+        return {
+            'html': context.view_all(),
+        }
+    grid = get_grid_cls(context)().req()
+    grid.value = query.all()
     return {
-        'html': context.view_all(),
+        'html': grid.display(),
+        'notice': notice,
     }
 
 
 @view_config(
     route_name='admin_edit',
     permission='sqladmin',
+    decorator=query_guard,
     renderer='sqladmin/default.mak')
 @view_config(
     route_name='admin_new',
     permission='sqladmin',
+    decorator=query_guard,
     renderer='sqladmin/default.mak')
 def add_or_update(context, request):
     """Add or update a DB object.
     """
     context_is_obj = not inspect.isclass(context)
-    widget = context.edit_form()
+    if context_is_obj and request.method == 'GET':
+        column = get_version_column(type(context))
+        if column is not None:
+            version = getattr(context, column.key)
+            if is_not_modified(request, version, type(context).__name__,
+                               context.pk_id):
+                return not_modified_response(request)
+
+    widget = get_edit_form(type(context) if context_is_obj else context,
+                           request)
     if request.method == 'POST':
         try:
             data = widget.validate(request.POST)
@@ -146,8 +547,8 @@ def add_or_update(context, request):
             obj.db_session_add()
             redirect_url = request.route_url(
                 'admin_edit',
-                classname=cls.__name__.lower(),
                 id=obj.pk_id,
+                **route_kw(request, cls)
             )
             return HTTPFound(location=redirect_url)
         except twc.ValidationError, e:
@@ -161,6 +562,43 @@ def add_or_update(context, request):
     }
 
 
+@view_config(
+    route_name='admin_lookup',
+    permission='sqladmin',
+    decorator=query_guard,
+    renderer='json')
+def lookup(context, request):
+    """Get a page of (pk, label) of the objects for which the label column
+    starts with the given query.
+    """
+    column = get_label_column(context)
+    limit = get_setting(request.registry.settings, 'lookup_limit')
+    query = context.query
+    q = request.GET.get('q')
+    if q:
+        search = column
+        if not isinstance(column.type, sa.String):
+            search = sa.cast(column, sa.String)
+        # Escape the LIKE wildcards to only make a prefix search, which can
+        # use the index of a string column but not of a casted one
+        q = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(search.like(q + '%', escape='\\'))
+    objs = query.order_by(column).limit(limit)
+    return {
+        'results': [(obj.pk_id, getattr(obj, column.key)) for obj in objs],
+    }
+
+
+@view_config(
+    context=QueryLimitExceeded,
+    renderer='sqladmin/error.mak')
+def query_limit_exceeded(exc, request):
+    """Display the limit exceeded by the request.
+    """
+    request.response.status_int = 503
+    return {'message': str(exc)}
+
+
 SETTINGS_PREFIX = 'sqladmin.'
 
 
@@ -170,9 +608,26 @@ def security_parser(value):
     return value
 
 
+def optional_parser(value):
+    return value or None
+
+
 default_settings = (
     ('route_prefix', str, '/admin'),
     ('acl', security_parser, 'sqladmin'),
+    ('autocomplete_threshold', int, 1000),
+    ('lookup_limit', int, 20),
+    ('stream_list', asbool, False),
+    ('stream_batch_size', int, 100),
+    ('multi_db', asbool, False),
+    ('profile_dir', optional_parser, None),
+    ('profile_sample_rate', float, 0.0),
+    ('profile_threshold', float, 0.0),
+    ('profile_max_files', int, 100),
+    ('statement_timeout', float, 0.0),
+    ('max_rows', int, 0),
+    ('readonly', asbool, False),
+    ('readonly_get', asbool, False),
     )
 
 
@@ -209,6 +664,12 @@ def includeme(config):
     assert route_prefix.startswith('/'), ('The route_prefix %s is not valid.'
          ' It should start with a /') % route_prefix
 
+    # With multi_db the classes are namespaced by database in the urls
+    multi_db = get_setting(settings, 'multi_db')
+    class_prefix = os.path.join(route_prefix, '{classname}')
+    if multi_db:
+        class_prefix = os.path.join(route_prefix, '{db}', '{classname}')
+
     config.add_route(
         'admin_home',
         route_prefix,
@@ -216,27 +677,43 @@ def includeme(config):
     )
     config.add_route(
         'admin_list',
-        os.path.join(route_prefix, '{classname}'),
+        class_prefix,
+        factory=admin_factory,
+        custom_predicates=(exist_class,),
+    )
+    config.add_route(
+        'admin_lookup',
+        os.path.join(class_prefix, 'lookup'),
         factory=admin_factory,
         custom_predicates=(exist_class,),
     )
     config.add_route(
         'admin_new',
-        os.path.join(route_prefix, '{classname}', 'new'),
+        os.path.join(class_prefix, 'new'),
         factory=admin_factory,
         custom_predicates=(exist_class,),
     )
     config.add_route(
         "admin_edit",
-        os.path.join(route_prefix, '{classname}', '{id}', 'edit'),
+        os.path.join(class_prefix, '{id}', 'edit'),
         factory=admin_factory,
         custom_predicates=(exist_object,),
     )
+    if get_setting(settings, 'profile_dir'):
+        config.include('pyramid_sqladmin.profiler')
+    if (get_setting(settings, 'readonly') or
+            get_setting(settings, 'readonly_get')):
+        config.include('pyramid_sqladmin.readonly')
     config.scan()
 
     # Set edit link on all the SQLAlchemy objects
-    for classname, cls in get_mapped_classes().items():
-        if not hasattr(cls, 'tws_edit_link'):
-            link = os.path.join(route_prefix, classname, '$', 'edit')
+    for db, classes in get_databases().items():
+        for classname, cls in classes.items():
+            if hasattr(cls, 'tws_edit_link'):
+                continue
+            prefix = route_prefix
+            if multi_db:
+                prefix = os.path.join(route_prefix, db)
+            link = os.path.join(prefix, classname, '$', 'edit')
             cls.tws_edit_link = link
 
@@ -0,0 +1,126 @@
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.response import FileResponse
+import cProfile
+import os
+import random
+import time
+
+from . import admin_factory, get_setting
+
+
+PROFILED_ROUTES = ('admin_home', 'admin_list', 'admin_new', 'admin_edit')
+PROFILE_EXT = '.pstats'
+
+
+def get_profiles(directory):
+    """Get the profile filenames of the given directory, the oldest first.
+
+    note:: The filenames start with the timestamp of the request, so sorting
+    them by name sorts them by date.
+    """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(n for n in os.listdir(directory) if n.endswith(PROFILE_EXT))
+
+
+def save_profile(profile, directory, max_files, filename):
+    """Save the stats of the profile in the directory, removing the oldest
+    profiles to keep at most max_files.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    profiles = get_profiles(directory)
+    for name in profiles[:max(0, len(profiles) - max_files + 1)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            # Already removed by another request
+            pass
+    profile.dump_stats(os.path.join(directory, filename))
+
+
+def profiler_tween_factory(handler, registry):
+    """Profile the admin requests with cProfile.
+
+    A request is saved if it's part of the sampled ones or if it's slower
+    than the threshold. When a threshold is defined, all the admin requests
+    are profiled since we can't know before which ones will be slow.
+    """
+    settings = registry.settings
+    route_prefix = get_setting(settings, 'route_prefix')
+    directory = get_setting(settings, 'profile_dir')
+    sample_rate = get_setting(settings, 'profile_sample_rate')
+    threshold = get_setting(settings, 'profile_threshold')
+    max_files = get_setting(settings, 'profile_max_files')
+
+    def profiler_tween(request):
+        if not request.path_info.startswith(route_prefix):
+            return handler(request)
+        sampled = random.random() < sample_rate
+        if not sampled and not threshold:
+            return handler(request)
+
+        profile = cProfile.Profile()
+        start = time.time()
+        response = profile.runcall(handler, request)
+        elapsed = time.time() - start
+
+        route = getattr(request, 'matched_route', None)
+        if route is None or route.name not in PROFILED_ROUTES:
+            return response
+        if sampled or elapsed >= threshold:
+            filename = '%017.6f-%s-%dms%s' % (
+                start, route.name, elapsed * 1000, PROFILE_EXT)
+            save_profile(profile, directory, max_files, filename)
+        return response
+
+    return profiler_tween
+
+
+# Views
+def profiles_index(request):
+    """Display the saved profiles, the newest first
+    """
+    directory = get_setting(request.registry.settings, 'profile_dir')
+    profiles = []
+    for name in reversed(get_profiles(directory)):
+        profiles += [(name, request.route_url('admin_profile', filename=name))]
+    return {'profiles': profiles}
+
+
+def profile_download(request):
+    """Download a saved profile
+    """
+    directory = get_setting(request.registry.settings, 'profile_dir')
+    filename = request.matchdict['filename']
+    # Only serve the listed files to not expose the file system
+    if filename not in get_profiles(directory):
+        raise HTTPNotFound()
+    return FileResponse(
+        os.path.join(directory, filename),
+        request=request,
+        content_type='application/octet-stream')
+
+
+def includeme(config):
+    route_prefix = get_setting(config.registry.settings, 'route_prefix')
+    config.add_tween('pyramid_sqladmin.profiler.profiler_tween_factory')
+    config.add_route(
+        'admin_profiles',
+        os.path.join(route_prefix, '_profiles'),
+        factory=admin_factory,
+    )
+    config.add_route(
+        'admin_profile',
+        os.path.join(route_prefix, '_profiles', '{filename}'),
+        factory=admin_factory,
+    )
+    config.add_view(
+        profiles_index,
+        route_name='admin_profiles',
+        permission='sqladmin',
+        renderer='sqladmin/profiles.mak')
+    config.add_view(
+        profile_download,
+        route_name='admin_profile',
+        permission='sqladmin')
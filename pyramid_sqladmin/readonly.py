@@ -0,0 +1,162 @@
+from pyramid.httpexceptions import HTTPForbidden
+from sqlalchemy.orm import class_mapper, Session
+from sqlalchemy.pool import Pool
+import sqlalchemy as sa
+import threading
+import types
+
+from . import get_databases, get_setting
+
+
+# The read-only sessions of the current request by bind, None when the
+# request is not read-only.
+_local = threading.local()
+
+
+class ReadOnlySession(Session):
+    """Session of the read-only requests. It doesn't join the zope
+    transaction: it's never committed.
+    """
+
+
+# Set in the info of the SQLite connections made query only
+QUERY_ONLY_KEY = 'sqladmin_query_only'
+
+
+def set_read_only(session, transaction, connection):
+    """Make the transaction read-only, and on PostgreSQL read a single
+    snapshot of the database.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, '
+                           'READ ONLY')
+    elif dialect == 'sqlite':
+        connection.execute('PRAGMA query_only = ON')
+        connection.connection.info[QUERY_ONLY_KEY] = True
+
+sa.event.listen(ReadOnlySession, 'after_begin', set_read_only)
+
+
+def checkin_query_only(dbapi_connection, connection_record):
+    """Allow the writes again on a SQLite connection returned to the pool
+    """
+    if not connection_record.info.pop(QUERY_ONLY_KEY, False):
+        return
+    if dbapi_connection is not None:
+        dbapi_connection.execute('PRAGMA query_only = OFF')
+
+sa.event.listen(Pool, 'checkin', checkin_query_only)
+
+
+def start_readonly():
+    _local.sessions = {}
+
+
+def end_readonly():
+    """Release the connections of the read-only sessions
+    """
+    sessions = getattr(_local, 'sessions', None)
+    _local.sessions = None
+    for session in (sessions or {}).values():
+        session.close()
+
+
+class ReadOnlyQueryProperty(object):
+    """Query property using a read-only session during the read-only requests
+    and the wrapped query property otherwise.
+    """
+
+    def __init__(self, query_property):
+        self.query_property = query_property
+
+    def __get__(self, instance, owner):
+        query = self.query_property.__get__(instance, owner)
+        sessions = getattr(_local, 'sessions', None)
+        if sessions is None:
+            return query
+        bind = query.session.get_bind(mapper=class_mapper(owner))
+        session = sessions.get(bind)
+        if session is None:
+            session = sessions[bind] = ReadOnlySession(bind=bind,
+                                                      autoflush=False)
+        return session.query(owner)
+
+
+def set_readonly_query_property(cls):
+    """Wrap the query property of cls, defined on cls or one of its bases.
+    """
+    for klass in cls.__mro__:
+        query_property = vars(klass).get('query')
+        if query_property is None:
+            continue
+        if not isinstance(query_property, ReadOnlyQueryProperty):
+            klass.query = ReadOnlyQueryProperty(query_property)
+        return
+
+
+def close_after(app_iter, close):
+    """Iterate the app_iter and call close at the end, or when the returned
+    iterator is closed without being iterated, like for a HEAD request.
+
+    note:: The returned generator is already started: the close method of a
+    generator which didn't start doesn't run its finally clause. It's still a
+    generator so the tw2 middleware doesn't buffer the streamed body.
+    """
+    def iterate():
+        try:
+            yield
+            for chunk in app_iter:
+                yield chunk
+        finally:
+            try:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+            finally:
+                close()
+
+    iterator = iterate()
+    next(iterator)
+    return iterator
+
+
+def readonly_tween_factory(handler, registry):
+    """Use read-only sessions for the GET admin requests, or for all the
+    admin requests in readonly mode where the other methods are forbidden.
+    """
+    settings = registry.settings
+    route_prefix = get_setting(settings, 'route_prefix')
+    readonly = get_setting(settings, 'readonly')
+
+    def readonly_tween(request):
+        # Release the read-only sessions of a previous request whose body
+        # hasn't been closed
+        end_readonly()
+        if not request.path_info.startswith(route_prefix):
+            return handler(request)
+        if request.method not in ('GET', 'HEAD'):
+            if readonly:
+                return HTTPForbidden('The admin is read-only')
+            return handler(request)
+
+        start_readonly()
+        try:
+            response = handler(request)
+        except:
+            end_readonly()
+            raise
+        if isinstance(response.app_iter, types.GeneratorType):
+            # The streamed responses are rendered after the tween returns
+            response.app_iter = close_after(response.app_iter, end_readonly)
+        else:
+            end_readonly()
+        return response
+
+    return readonly_tween
+
+
+def includeme(config):
+    config.add_tween('pyramid_sqladmin.readonly.readonly_tween_factory')
+    for classes in get_databases().values():
+        for cls in classes.values():
+            set_readonly_query_property(cls)
@@ -0,0 +1,6 @@
+<%namespace name="tw" module="tw2.core.mako_util"/>\
+<span class="sqladmin-autocomplete">
+  <input ${tw.attrs(attrs=w.attrs)}/>
+  <input ${tw.attrs(attrs=w.label_attrs)}/>
+  <datalist id="${w.compound_id}:options"></datalist>
+</span>
@@ -1,3 +1,6 @@
 <%inherit file="base.mak" />
 
+% if context.get('notice'):
+<p>${notice}</p>
+% endif
 ${html|n}
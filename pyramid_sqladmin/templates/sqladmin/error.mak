@@ -0,0 +1,3 @@
+<%inherit file="base.mak" />
+
+<p>${message}</p>
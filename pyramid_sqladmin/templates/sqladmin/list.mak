@@ -0,0 +1,13 @@
+<%inherit file="base.mak" />
+
+% if notice:
+<p>${notice}</p>
+% endif
+<table>
+<tr>
+% for label in labels:
+  <th>${label}</th>
+% endfor
+</tr>
+${rows|n}
+</table>
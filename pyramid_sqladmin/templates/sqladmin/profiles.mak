@@ -0,0 +1,7 @@
+<%inherit file="base.mak" />
+
+<ul>
+% for name, link in profiles:
+  <li><a href="${link}">${name}</a></li>
+% endfor
+</ul>
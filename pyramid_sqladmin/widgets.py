@@ -0,0 +1,88 @@
+import tw2.core as twc
+import tw2.forms as twf
+from tw2.sqla.widgets import RelatedValidator
+
+
+# Fill the datalist of the autocomplete fields with the objects returned by
+# the lookup view and keep the hidden input in sync with the chosen label.
+autocomplete_js = twc.JSSource(src=u'''
+(function() {
+  function options(input) {
+    return document.getElementById(input.getAttribute('list'));
+  }
+  function lookup(input) {
+    var xhr = new XMLHttpRequest();
+    var url = input.getAttribute('data-lookup-url');
+    xhr.open('GET', url + '?q=' + encodeURIComponent(input.value));
+    xhr.onload = function() {
+      if (xhr.status !== 200) { return; }
+      var datalist = options(input);
+      var results = JSON.parse(xhr.responseText).results;
+      datalist.innerHTML = '';
+      for (var i = 0; i < results.length; i++) {
+        var option = document.createElement('option');
+        option.value = results[i][1];
+        option.setAttribute('data-pk', results[i][0]);
+        datalist.appendChild(option);
+      }
+    };
+    xhr.send();
+  }
+  function select(input) {
+    var target = document.getElementById(input.getAttribute('data-target'));
+    var datalist = options(input);
+    target.value = '';
+    for (var i = 0; i < datalist.options.length; i++) {
+      if (datalist.options[i].value === input.value) {
+        target.value = datalist.options[i].getAttribute('data-pk');
+      }
+    }
+  }
+  document.addEventListener('input', function(e) {
+    if (e.target.getAttribute('data-lookup-url')) { lookup(e.target); }
+  });
+  document.addEventListener('change', function(e) {
+    if (e.target.getAttribute('data-lookup-url')) { select(e.target); }
+  });
+})();
+''')
+
+
+class AutocompleteField(twf.InputField):
+    """Select a related object by querying the admin lookup view instead of
+    rendering all the related objects in a select.
+    """
+    template = 'mako:pyramid_sqladmin.templates.autocomplete'
+    type = 'hidden'
+    entity = twc.Param('SQLAlchemy mapped class to use', request_local=False)
+    label_key = twc.Param('The attribute used to label the entity objects')
+    lookup_url = twc.Param('The url of the lookup view of the entity')
+    resources = [autocomplete_js]
+
+    @classmethod
+    def post_define(cls):
+        if getattr(cls, 'entity', None):
+            required = cls.required or getattr(cls.validator, 'required',
+                                               None)
+            cls.validator = RelatedValidator(entity=cls.entity,
+                                             required=required)
+
+    def prepare(self):
+        super(AutocompleteField, self).prepare()
+        # The hidden input can't be required in the browser, the label can
+        required = self.attrs.pop('required', None)
+        label = u''
+        if self.value:
+            obj = self.entity.query.get(self.value)
+            if obj is not None:
+                label = getattr(obj, self.label_key)
+        self.label_attrs = {
+            'type': 'text',
+            'id': '%s:label' % self.compound_id,
+            'value': label,
+            'list': '%s:options' % self.compound_id,
+            'autocomplete': 'off',
+            'data-target': self.compound_id,
+            'data-lookup-url': self.lookup_url,
+            'required': required,
+        }
@@ -5,6 +5,8 @@ from pyramid.authentication import AuthTktAuthenticationPolicy
 from pyramid.authorization import ACLAuthorizationPolicy
 from pyramid.session import UnencryptedCookieSessionFactoryConfig
 from pyramid import testing
+from pyramid.request import Request
+from pyramid.threadlocal import get_current_registry
 from pyramid.security import remember, forget, Everyone
 import sqlalchemy as sa
 from sqlalchemy.orm import (
@@ -14,6 +16,7 @@ from sqlalchemy.orm import (
     )
 from zope.sqlalchemy import ZopeTransactionExtension
 from sqla_declarative.declarative import extended_declarative_base
+import datetime
 import transaction
 import pyramid_sqladmin as pysqla
 import tw2.core as twc
@@ -27,9 +30,15 @@ class TestInit(unittest.TestCase):
         request.registry.settings = {'sqladmin.acl': 'sqladmin'}
         return request
 
+    def get_request(self, headers=None):
+        request = Request.blank('/', headers=headers)
+        request.registry = get_current_registry()
+        return request
+
     def setUp(self):
         clear_mappers()
         pysqla.AVAILABLE_OBJECTS = pysqla._marker
+        pysqla._large_tables.clear()
         self.session = scoped_session(sessionmaker(extension=ZopeTransactionExtension()))
         Base = extended_declarative_base(
             self.session,
@@ -45,6 +54,7 @@ class TestInit(unittest.TestCase):
 
         Base.metadata.create_all()
 
+        self.Base = Base
         self.Test1 = Test1
         self.Test2 = Test2
         with transaction.manager:
@@ -65,6 +75,157 @@ class TestInit(unittest.TestCase):
     def test_get_class(self):
         self.assertEqual(pysqla.get_class('unexisting'), None)
         self.assertEqual(pysqla.get_class('test1'), self.Test1)
+        self.assertEqual(pysqla.get_class('test1', 'default'), self.Test1)
+        self.assertEqual(pysqla.get_class('test1', 'other'), None)
+
+    def get_other_base(self):
+        session = scoped_session(sessionmaker(extension=ZopeTransactionExtension()))
+        Base = extended_declarative_base(
+            session,
+            metadata=sa.MetaData('sqlite:///:memory:'))
+        Base.__sqladmin_db__ = 'other'
+        return Base
+
+    def test_get_databases(self):
+        Base = self.get_other_base()
+
+        class Test1(Base):
+            id = sa.Column(sa.Integer, primary_key=True)
+
+        self.assertEqual(pysqla.get_db_name(self.Test1), 'default')
+        self.assertEqual(pysqla.get_db_name(Test1), 'other')
+        result = pysqla.get_databases()
+        expected = {
+            'default': {'test1': self.Test1, 'test2': self.Test2},
+            'other': {'test1': Test1},
+        }
+        self.assertEqual(result, expected)
+        self.assertEqual(pysqla.get_mapped_classes('other'), {'test1': Test1})
+        self.assertEqual(pysqla.get_class('test1', 'other'), Test1)
+        self.assertEqual(pysqla.get_class('test1', 'default'), self.Test1)
+
+    def test_route_kw(self):
+        request = self.get_dummy_request()
+        self.assertEqual(pysqla.route_kw(request, self.Test1),
+                         {'classname': 'test1'})
+        request.matchdict['db'] = 'default'
+        self.assertEqual(pysqla.route_kw(request, self.Test1),
+                         {'classname': 'test1', 'db': 'default'})
+
+    def test_get_label_column(self):
+        self.assertEqual(pysqla.get_label_column(self.Test1), self.Test1.name)
+
+        class Test3(self.Base):
+            id = sa.Column(sa.Integer, primary_key=True)
+            number = sa.Column(sa.Integer)
+
+        self.assertEqual(pysqla.get_label_column(Test3), Test3.id)
+        Test3.__sqladmin_label__ = 'number'
+        self.assertEqual(pysqla.get_label_column(Test3), Test3.number)
+
+    def test_is_large_table(self):
+        self.assertEqual(pysqla.is_large_table(self.Test1, 1), False)
+        with transaction.manager:
+            self.session.add(self.Test1(name='Fred'))
+        # The answer is cached
+        self.assertEqual(pysqla.is_large_table(self.Test1, 1), False)
+        self.assertEqual(pysqla.is_large_table(self.Test1, 2), False)
+
+        key = (self.Test1, 1)
+        pysqla._large_tables[key] = (0, False)
+        self.assertEqual(pysqla.is_large_table(self.Test1, 1), True)
+
+    def test_get_autocomplete_widgets(self):
+        class Test3(self.Base):
+            id = sa.Column(sa.Integer, primary_key=True)
+            test1_id = sa.Column(sa.Integer, sa.ForeignKey('test1.id'))
+            test1 = sa.orm.relationship('Test1', backref='tests3')
+
+        request = self.get_dummy_request()
+        request.registry.settings['sqladmin.autocomplete_threshold'] = 1
+        request.route_path = lambda *args, **kw: '/admin/%s/lookup' % kw['classname']
+        self.assertEqual(pysqla.get_autocomplete_widgets(Test3, request), {})
+
+        with transaction.manager:
+            self.session.add(self.Test1(name='Fred'))
+        pysqla._large_tables.clear()
+        widgets = pysqla.get_autocomplete_widgets(Test3, request)
+        self.assertEqual(widgets.keys(), ['test1'])
+        widget = widgets['test1']
+        self.assertTrue(issubclass(widget, pysqla.AutocompleteField))
+        self.assertEqual(widget.id, 'test1')
+        self.assertEqual(widget.entity, self.Test1)
+        self.assertEqual(widget.label_key, 'name')
+        self.assertEqual(widget.lookup_url, '/admin/test1/lookup')
+
+        request.registry.settings['sqladmin.autocomplete_threshold'] = 2
+        self.assertEqual(pysqla.get_autocomplete_widgets(Test3, request), {})
+
+        # Don't override a widget defined by the user
+        request.registry.settings['sqladmin.autocomplete_threshold'] = 1
+        prop = sa.orm.class_mapper(Test3).get_property('test1')
+        prop.info['edit_widget'] = pysqla.tws.widgets.DbSingleSelectField
+        self.assertEqual(pysqla.get_autocomplete_widgets(Test3, request), {})
+
+    def test_get_edit_form(self):
+        class Test3(self.Base):
+            id = sa.Column(sa.Integer, primary_key=True)
+            test1_id = sa.Column(sa.Integer, sa.ForeignKey('test1.id'))
+            test1 = sa.orm.relationship('Test1', backref='tests3')
+
+        request = self.get_dummy_request()
+        request.registry.settings['sqladmin.autocomplete_threshold'] = 1
+        request.route_path = lambda *args, **kw: '/admin/%s/lookup' % kw['classname']
+        with transaction.manager:
+            self.session.add(self.Test1(name='Fred'))
+
+        form = pysqla.get_edit_form(Test3, request)
+        widget = [c for c in form.child.children if c.id == 'test1'][0]
+        self.assertTrue(isinstance(widget, pysqla.AutocompleteField))
+        # The mapper is left untouched: the forms of the application still
+        # use a select
+        prop = sa.orm.class_mapper(Test3).get_property('test1')
+        self.assertTrue('edit_widget' not in prop.info)
+        form = Test3.edit_form()
+        widget = [c for c in form.child.children if c.id == 'test1'][0]
+        self.assertFalse(isinstance(widget, pysqla.AutocompleteField))
+
+    def test_get_version_column(self):
+        self.assertEqual(pysqla.get_version_column(self.Test1), None)
+
+        class Test3(self.Base):
+            id = sa.Column(sa.Integer, primary_key=True)
+            updated_at = sa.Column(sa.DateTime)
+
+        class Test4(self.Base):
+            id = sa.Column(sa.Integer, primary_key=True)
+            version = sa.Column(sa.Integer, nullable=False)
+            __mapper_args__ = {'version_id_col': version}
+
+        self.assertEqual(pysqla.get_version_column(Test3), Test3.updated_at)
+        self.assertEqual(pysqla.get_version_column(Test4), Test4.version)
+
+    def test_is_not_modified(self):
+        request = self.get_request()
+        self.assertEqual(pysqla.is_not_modified(request, 1, 'Test1'), False)
+        etag = request.response.etag
+        self.assertTrue(etag)
+        self.assertEqual(request.response.last_modified, None)
+
+        request = self.get_request({'If-None-Match': '"%s"' % etag})
+        self.assertEqual(pysqla.is_not_modified(request, 1, 'Test1'), True)
+        request = self.get_request({'If-None-Match': '"%s"' % etag})
+        self.assertEqual(pysqla.is_not_modified(request, 2, 'Test1'), False)
+
+        version = datetime.datetime(2013, 1, 1, 12, 0)
+        request = self.get_request()
+        self.assertEqual(pysqla.is_not_modified(request, version), False)
+        last_modified = request.response.headers['Last-Modified']
+        request = self.get_request({'If-Modified-Since': last_modified})
+        self.assertEqual(pysqla.is_not_modified(request, version), True)
+        version = datetime.datetime(2013, 1, 2, 12, 0)
+        request = self.get_request({'If-Modified-Since': last_modified})
+        self.assertEqual(pysqla.is_not_modified(request, version), False)
 
     def test_get_obj(self):
         info = {'match': {
@@ -132,8 +293,57 @@ class TestInit(unittest.TestCase):
         cls = pysqla.admin_factory(request)
         self.assertEqual(cls.__acl__, [('Allow', 'sqladmin', 'sqladmin')])
 
+    def test_get_list_query(self):
+        with transaction.manager:
+            self.session.add(self.Test1(name='Fred'))
+        request = self.get_dummy_request()
+        query, notice = pysqla.get_list_query(self.Test1, request)
+        self.assertEqual(query.count(), 2)
+        self.assertEqual(notice, None)
+
+        request.registry.settings['sqladmin.max_rows'] = 2
+        query, notice = pysqla.get_list_query(self.Test1, request)
+        self.assertEqual(query.count(), 2)
+        self.assertEqual(notice, None)
+
+        request.registry.settings['sqladmin.max_rows'] = 1
+        query, notice = pysqla.get_list_query(self.Test1, request)
+        self.assertEqual([o.name for o in query], ['Bob'])
+        self.assertEqual(notice, 'Only the first 1 Test1 are displayed')
+
+    def test_query_guard(self):
+        sql = ('WITH RECURSIVE c(x) AS '
+               '(SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 10000000) '
+               'SELECT count(*) FROM c')
+
+        def view(context, request):
+            return self.session.execute(sql, mapper=context).scalar()
+
+        def bad_view(context, request):
+            return self.session.execute('SELECT unexisting', mapper=context)
+
+        request = self.get_dummy_request()
+        request.registry.settings['sqladmin.statement_timeout'] = 0.01
+        guarded = pysqla.query_guard(view)
+        self.assertRaises(pysqla.QueryLimitExceeded,
+                          guarded, self.Test1, request)
+        guarded = pysqla.query_guard(bad_view)
+        self.assertRaises(sa.exc.OperationalError,
+                          guarded, self.Test1, request)
+
+        request = self.get_dummy_request()
+        guarded = pysqla.query_guard(lambda context, request: 'home')
+        self.assertEqual(guarded(pysqla.HomeFactory(), request), 'home')
+
+    def test_query_limit_exceeded(self):
+        request = self.get_dummy_request()
+        exc = pysqla.QueryLimitExceeded('Too many rows')
+        response = pysqla.query_limit_exceeded(exc, request)
+        self.assertEqual(response, {'message': 'Too many rows'})
+        self.assertEqual(request.response.status_int, 503)
+
     def test_home(self):
-        request = testing.DummyRequest()
+        request = self.get_dummy_request()
         request.route_url = lambda *args, **kw: 'http://server/%s' % kw['classname']
         response = pysqla.home(request)
         expected = {
@@ -142,13 +352,141 @@ class TestInit(unittest.TestCase):
         }
         self.assertEqual(response, expected)
 
+        request.registry.settings['sqladmin.multi_db'] = True
+        request.route_url = lambda *args, **kw: 'http://server/%(db)s/%(classname)s' % kw
+        response = pysqla.home(request)
+        expected = {
+            'links': [('default.Test1', 'http://server/default/test1'),
+                      ('default.Test2', 'http://server/default/test2')]
+        }
+        self.assertEqual(response, expected)
+
     def test_admin_list(self):
-        request = testing.DummyRequest()
+        request = self.get_dummy_request()
         self.Test1.view_all = classmethod(lambda *args, **kw: 'view all')
         response = pysqla.admin_list(self.Test1, request)
         expected = {'html': 'view all'}
         self.assertEqual(response, expected)
 
+    def test_lookup(self):
+        with transaction.manager:
+            self.session.add(self.Test1(name='Fred'))
+            self.session.add(self.Test1(name='Bo_b'))
+        request = self.get_dummy_request()
+        request.registry.settings['sqladmin.lookup_limit'] = 20
+        response = pysqla.lookup(self.Test1, request)
+        expected = {'results': [(3, 'Bo_b'), (1, 'Bob'), (2, 'Fred')]}
+        self.assertEqual(response, expected)
+
+        request.GET['q'] = 'Bo'
+        response = pysqla.lookup(self.Test1, request)
+        expected = {'results': [(3, 'Bo_b'), (1, 'Bob')]}
+        self.assertEqual(response, expected)
+
+        request.GET['q'] = 'Bo_'
+        response = pysqla.lookup(self.Test1, request)
+        expected = {'results': [(3, 'Bo_b')]}
+        self.assertEqual(response, expected)
+
+        request.registry.settings['sqladmin.lookup_limit'] = 1
+        request.GET['q'] = ''
+        response = pysqla.lookup(self.Test1, request)
+        expected = {'results': [(3, 'Bo_b')]}
+        self.assertEqual(response, expected)
+
+    def test_admin_list_not_modified(self):
+        class Test3(self.Base):
+            id = sa.Column(sa.Integer, primary_key=True)
+            updated_at = sa.Column(sa.DateTime)
+
+        self.Base.metadata.create_all()
+        with transaction.manager:
+            self.session.add(Test3(updated_at=datetime.datetime(2013, 1, 1)))
+        Test3.view_all = classmethod(lambda *args, **kw: 'view all')
+
+        request = self.get_request()
+        response = pysqla.admin_list(Test3, request)
+        self.assertEqual(response, {'html': 'view all'})
+        etag = request.response.etag
+
+        request = self.get_request({'If-None-Match': '"%s"' % etag})
+        response = pysqla.admin_list(Test3, request)
+        self.assertEqual(response.status_int, 304)
+
+        with transaction.manager:
+            self.session.add(Test3(updated_at=datetime.datetime(2012, 1, 1)))
+        request = self.get_request({'If-None-Match': '"%s"' % etag})
+        response = pysqla.admin_list(Test3, request)
+        self.assertEqual(response, {'html': 'view all'})
+
+        class Test4(self.Base):
+            id = sa.Column(sa.Integer, primary_key=True)
+            name = sa.Column(sa.String(50))
+            version = sa.Column(sa.Integer, nullable=False)
+            __mapper_args__ = {'version_id_col': version}
+
+        self.Base.metadata.create_all()
+        with transaction.manager:
+            self.session.add_all([Test4(name='Bob'), Test4(name='Fred')])
+        with transaction.manager:
+            Test4.query.get(2).name = 'Alice'
+        Test4.view_all = classmethod(lambda *args, **kw: 'view all')
+        request = self.get_request()
+        pysqla.admin_list(Test4, request)
+        etag = request.response.etag
+
+        # The max of the versions is still 2
+        with transaction.manager:
+            Test4.query.get(1).name = 'John'
+        request = self.get_request({'If-None-Match': '"%s"' % etag})
+        response = pysqla.admin_list(Test4, request)
+        self.assertEqual(response, {'html': 'view all'})
+
+        # A deleted row replaced by a new one at the same version
+        with transaction.manager:
+            self.session.add_all([Test4(name='Bob'), Test4(name='Fred')])
+        request = self.get_request()
+        pysqla.admin_list(Test4, request)
+        etag = request.response.etag
+        with transaction.manager:
+            self.session.delete(Test4.query.get(3))
+            self.session.add(Test4(name='Bob'))
+        request = self.get_request({'If-None-Match': '"%s"' % etag})
+        response = pysqla.admin_list(Test4, request)
+        self.assertEqual(response, {'html': 'view all'})
+
+        # Same with a new row older than the max of updated_at
+        with transaction.manager:
+            self.session.add(Test3(updated_at=datetime.datetime(2011, 1, 1)))
+        request = self.get_request()
+        pysqla.admin_list(Test3, request)
+        etag = request.response.etag
+        with transaction.manager:
+            self.session.delete(Test3.query.get(2))
+            self.session.add(Test3(updated_at=datetime.datetime(2012, 1, 1)))
+        request = self.get_request({'If-None-Match': '"%s"' % etag})
+        response = pysqla.admin_list(Test3, request)
+        self.assertEqual(response, {'html': 'view all'})
+
+    def test_edit_not_modified(self):
+        class Test3(self.Base):
+            id = sa.Column(sa.Integer, primary_key=True)
+            version = sa.Column(sa.Integer, nullable=False)
+            __mapper_args__ = {'version_id_col': version}
+
+        self.Base.metadata.create_all()
+        with transaction.manager:
+            self.session.add(Test3())
+        Test3.edit_form = classmethod(lambda *args, **kw: self.fail())
+
+        obj = Test3.query.get(1)
+        request = self.get_request()
+        pysqla.is_not_modified(request, obj.version, 'Test3', obj.pk_id)
+        etag = request.response.etag
+        request = self.get_request({'If-None-Match': '"%s"' % etag})
+        response = pysqla.add_or_update(obj, request)
+        self.assertEqual(response.status_int, 304)
+
     def test_GET_add_or_update(self):
         class MockForm(object):
             value = None
@@ -234,15 +572,42 @@ class TestInit(unittest.TestCase):
         result = pysqla.parse_settings(settings)
         expected = {
             'sqladmin.route_prefix': '/admin',
-            'sqladmin.acl': 'sqladmin'}
+            'sqladmin.acl': 'sqladmin',
+            'sqladmin.autocomplete_threshold': 1000,
+            'sqladmin.lookup_limit': 20,
+            'sqladmin.stream_list': False,
+            'sqladmin.stream_batch_size': 100,
+            'sqladmin.multi_db': False,
+            'sqladmin.profile_dir': None,
+            'sqladmin.profile_sample_rate': 0.0,
+            'sqladmin.profile_threshold': 0.0,
+            'sqladmin.profile_max_files': 100,
+            'sqladmin.statement_timeout': 0.0,
+            'sqladmin.max_rows': 0,
+            'sqladmin.readonly': False,
+            'sqladmin.readonly_get': False}
         self.assertEqual(result, expected)
 
         settings = {
-            'sqladmin.route_prefix': '/backoffice'}
+            'sqladmin.route_prefix': '/backoffice',
+            'sqladmin.autocomplete_threshold': '50'}
         result = pysqla.parse_settings(settings)
         expected = {
             'sqladmin.route_prefix': '/backoffice',
-            'sqladmin.acl': 'sqladmin'}
+            'sqladmin.acl': 'sqladmin',
+            'sqladmin.autocomplete_threshold': 50,
+            'sqladmin.lookup_limit': 20,
+            'sqladmin.stream_list': False,
+            'sqladmin.stream_batch_size': 100,
+            'sqladmin.multi_db': False,
+            'sqladmin.profile_dir': None,
+            'sqladmin.profile_sample_rate': 0.0,
+            'sqladmin.profile_threshold': 0.0,
+            'sqladmin.profile_max_files': 100,
+            'sqladmin.statement_timeout': 0.0,
+            'sqladmin.max_rows': 0,
+            'sqladmin.readonly': False,
+            'sqladmin.readonly_get': False}
         self.assertEqual(result, expected)
 
     def test_get_setting(self):
@@ -288,6 +653,32 @@ class IntegrationTests(unittest.TestCase):
         expected = 'http://example.com/admin/test1/1/edit'
         self.assertEqual(url, expected)
 
+        url = request.route_url('admin_lookup', classname='test1')
+        expected = 'http://example.com/admin/test1/lookup'
+        self.assertEqual(url, expected)
+
+    def test_multi_db_url(self):
+        testing.tearDown()
+        self.config = testing.setUp(settings={'sqladmin.multi_db': 'true'})
+        self.config.include('pyramid_sqladmin')
+        request = testing.DummyRequest()
+        url = request.route_url('admin_home')
+        expected = 'http://example.com/admin'
+        self.assertEqual(url, expected)
+
+        url = request.route_url('admin_list', db='main', classname='test1')
+        expected = 'http://example.com/admin/main/test1'
+        self.assertEqual(url, expected)
+
+        url = request.route_url('admin_new', db='main', classname='test1')
+        expected = 'http://example.com/admin/main/test1/new'
+        self.assertEqual(url, expected)
+
+        url = request.route_url('admin_edit', db='main', classname='test1',
+                                id=1)
+        expected = 'http://example.com/admin/main/test1/1/edit'
+        self.assertEqual(url, expected)
+
 
 class FunctionalTests(unittest.TestCase):
 
@@ -299,11 +690,11 @@ class FunctionalTests(unittest.TestCase):
     def get_user_from_request(self, *args, **kw):
         return None
 
-    def main(self, settings):
+    def main(self, settings, url='sqlite:///:memory:'):
         self.session = scoped_session(sessionmaker(extension=ZopeTransactionExtension()))
         Base = extended_declarative_base(
             self.session,
-            metadata=sa.MetaData('sqlite:///:memory:'))
+            metadata=sa.MetaData(url))
 
         class Test1(Base):
             id = sa.Column(sa.Integer, primary_key=True)
@@ -313,10 +704,17 @@ class FunctionalTests(unittest.TestCase):
             idtest = sa.Column(sa.Integer, primary_key=True)
             name = sa.Column(sa.String(50), nullable=False)
 
+        class Test3(Base):
+            id = sa.Column(sa.Integer, primary_key=True)
+            test2_id = sa.Column(sa.Integer, sa.ForeignKey('test2.idtest'),
+                                 nullable=False)
+            test2 = sa.orm.relationship('Test2', backref='tests3')
+
         Base.metadata.create_all()
 
         self.Test1 = Test1
         self.Test2 = Test2
+        self.Test3 = Test3
         with transaction.manager:
             self.value1 = Test1(name='Bob')
             self.session.add(self.value1)
@@ -377,6 +775,97 @@ class FunctionalTests(unittest.TestCase):
        response = self.testapp.get('/admin/test1', headers=headers, status=200)
        self.assertTrue('/admin/test1/1/edit' in response.body)
 
+    def test_admin_list_stream(self):
+        clear_mappers()
+        pysqla.AVAILABLE_OBJECTS = pysqla._marker
+        self.app = self.main({
+            'sqladmin.stream_list': 'true',
+            'sqladmin.stream_batch_size': '1'})
+        self.app = twc.middleware.TwMiddleware(self.app)
+        self.testapp = TestApp(self.app)
+        with transaction.manager:
+            self.session.add(self.Test1(name='Fred'))
+
+        headers = self.__remember()
+        response = self.testapp.get('/admin/test1', headers=headers, status=200)
+        self.assertTrue('<th>Name</th>' in response.body)
+        self.assertTrue('/admin/test1/1/edit' in response.body)
+        self.assertTrue('/admin/test1/2/edit' in response.body)
+        self.assertTrue('sqladmin rows' not in response.body)
+        # The rows are numbered like in the rendered list
+        self.assertTrue('<tr id="0" class="odd">' in response.body)
+        self.assertTrue('<tr id="1" class="even">' in response.body)
+        # The tw2 request local storage is cleared at the end of the stream
+        self.assertEqual(twc.core.request_local(), {})
+
+        with transaction.manager:
+            self.Test1.query.delete()
+        response = self.testapp.get('/admin/test1', headers=headers, status=200)
+        self.assertTrue('<th>Name</th>' in response.body)
+        self.assertTrue('/admin/test1/1/edit' not in response.body)
+
+    def test_admin_list_max_rows(self):
+        clear_mappers()
+        pysqla.AVAILABLE_OBJECTS = pysqla._marker
+        self.app = self.main({'sqladmin.max_rows': '1'})
+        self.app = twc.middleware.TwMiddleware(self.app)
+        self.testapp = TestApp(self.app)
+
+        headers = self.__remember()
+        response = self.testapp.get('/admin/test1', headers=headers, status=200)
+        self.assertTrue('/admin/test1/1/edit' in response.body)
+        self.assertTrue('Only the first' not in response.body)
+        with transaction.manager:
+            self.session.add(self.Test1(name='Fred'))
+        response = self.testapp.get('/admin/test1', headers=headers, status=200)
+        self.assertTrue('/admin/test1/1/edit' in response.body)
+        self.assertTrue('/admin/test1/2/edit' not in response.body)
+        self.assertTrue('Only the first 1 Test1 are displayed' in response.body)
+
+    def test_admin_list_stream_max_rows(self):
+        clear_mappers()
+        pysqla.AVAILABLE_OBJECTS = pysqla._marker
+        self.app = self.main({
+            'sqladmin.stream_list': 'true',
+            'sqladmin.max_rows': '1'})
+        self.app = twc.middleware.TwMiddleware(self.app)
+        self.testapp = TestApp(self.app)
+        with transaction.manager:
+            self.session.add(self.Test1(name='Fred'))
+
+        headers = self.__remember()
+        response = self.testapp.get('/admin/test1', headers=headers, status=200)
+        self.assertTrue('/admin/test1/1/edit' in response.body)
+        self.assertTrue('/admin/test1/2/edit' not in response.body)
+        self.assertTrue('Only the first 1 Test1 are displayed' in response.body)
+
+    def test_autocomplete(self):
+        clear_mappers()
+        pysqla.AVAILABLE_OBJECTS = pysqla._marker
+        self.app = self.main({'sqladmin.autocomplete_threshold': '0'})
+        self.app = twc.middleware.TwMiddleware(self.app)
+        self.testapp = TestApp(self.app)
+
+        headers = self.__remember()
+        response = self.testapp.get('/admin/test3/new', headers=headers,
+                                    status=200)
+        self.assertTrue('data-lookup-url="/admin/test2/lookup"' in response.body)
+        self.assertTrue('<select' not in response.body)
+        self.assertTrue('<input required="required" list="test2:options"' in response.body)
+
+        # The relation is required since its column isn't nullable
+        response = self.testapp.post('/admin/test3/new', headers=headers,
+                                     params={'test2': ''}, status=200)
+        self.assertTrue('Enter a value' in response.body)
+        self.assertEqual(self.Test3.query.count(), 0)
+
+        response = self.testapp.post('/admin/test3/new', headers=headers,
+                                     params={'test2': '1'}, status=302)
+        self.assertEqual(self.Test3.query.one().test2_id, 1)
+        response = self.testapp.get('/admin/test3/1/edit', headers=headers,
+                                    status=200)
+        self.assertTrue('value="Bob"' in response.body)
+
     def test_add_get(self):
        response = self.testapp.get('/admin/test1/new', status=403)
        headers = self.__remember()
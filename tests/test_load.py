@@ -0,0 +1,259 @@
+"""Load tests of the admin served by a multi-threaded WSGI server.
+
+They are slow, so they only run when SQLADMIN_LOAD_TEST is set:
+
+    SQLADMIN_LOAD_TEST=1 nosetests -s tests/test_load.py
+
+SQLADMIN_LOAD_REQUESTS sets the number of requests made by each client
+thread and SQLADMIN_LOAD_THREADS the comma separated numbers of client
+threads to run (default: 1, 2, 4... up to twice the number of cores).
+"""
+import unittest
+import multiprocessing
+import os
+import random
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+import urllib
+import urllib2
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+from nose.plugins.skip import SkipTest
+from pyramid import testing
+from pyramid.security import remember
+from sqlalchemy.orm import clear_mappers
+import sqlalchemy as sa
+import transaction
+import tw2.core as twc
+import tw2.core.core
+import tw2.core.util
+import pyramid_sqladmin as pysqla
+
+import test_init
+
+
+class ThreadingWSGIServer(SocketServer.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class NoRedirectHandler(urllib2.HTTPRedirectHandler):
+
+    def http_error_302(self, req, fp, code, msg, headers):
+        return fp
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Stats(object):
+    """Thread-safe counters of the load test
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = []
+        self.db_durations = []
+        self.errors = 0
+        self.locked = 0
+
+    def add(self, duration, error=False):
+        with self.lock:
+            self.durations.append(duration)
+            if error:
+                self.errors += 1
+
+    def add_db(self, duration):
+        with self.lock:
+            self.db_durations.append(duration)
+
+    def add_locked(self):
+        with self.lock:
+            self.locked += 1
+
+
+class DBTimer(object):
+    """Measure the time spent by each request in the database calls of the
+    dialect. SQLite waits for the locks in these calls, until its busy
+    timeout, so it includes the lock waits.
+    """
+
+    def __init__(self, dialect):
+        self.local = threading.local()
+        for name in ['do_execute', 'do_execute_no_params', 'do_executemany',
+                     'do_commit', 'do_rollback']:
+            setattr(dialect, name, self.timed(getattr(dialect, name)))
+
+    def timed(self, func):
+        def wrapper(*args, **kw):
+            start = time.time()
+            try:
+                return func(*args, **kw)
+            finally:
+                self.local.duration = (getattr(self.local, 'duration', 0) +
+                                       time.time() - start)
+        return wrapper
+
+    def start(self):
+        self.local.duration = 0
+
+    def stop(self):
+        return self.local.duration
+
+
+class LoadMiddleware(object):
+    """Count the database lock errors, measure the time spent in the
+    database and release the session at the end of each request, since the
+    server runs each request in a new thread.
+    """
+
+    def __init__(self, app, session, stats, timer):
+        self.app = app
+        self.session = session
+        self.stats = stats
+        self.timer = timer
+
+    def __call__(self, environ, start_response):
+        self.timer.start()
+        try:
+            return self.app(environ, start_response)
+        except sa.exc.OperationalError, e:
+            if 'locked' in str(e.orig):
+                self.stats.add_locked()
+            raise
+        finally:
+            transaction.abort()
+            self.session.remove()
+            self.stats.add_db(self.timer.stop())
+
+
+def get_thread_counts():
+    value = os.environ.get('SQLADMIN_LOAD_THREADS')
+    if value:
+        return [int(v) for v in value.split(',')]
+    counts = [1]
+    while counts[-1] < multiprocessing.cpu_count() * 2:
+        counts.append(counts[-1] * 2)
+    return counts
+
+
+class LoadTests(unittest.TestCase):
+
+    def setUp(self):
+        if not os.environ.get('SQLADMIN_LOAD_TEST'):
+            raise SkipTest('Set SQLADMIN_LOAD_TEST to run the load tests')
+        # tw2.core.testbase, imported by test_init, replaces the request local
+        # storage of tw2 by one shared by all the threads
+        self.request_local = tw2.core.core.request_local
+        tw2.core.core.request_local = tw2.core.util.thread_local
+        clear_mappers()
+        pysqla.AVAILABLE_OBJECTS = pysqla._marker
+        self.directory = tempfile.mkdtemp()
+        # A file database: each thread has its own in-memory database
+        url = 'sqlite:///%s' % os.path.join(self.directory, 'load.db')
+        self.functional = test_init.FunctionalTests('test_home')
+        app = self.functional.main({}, url=url)
+        self.registry = app.registry
+        # includeme has filled the registry of the mapped classes: reset it
+        # so the first concurrent requests race to fill it
+        pysqla.AVAILABLE_OBJECTS = pysqla._marker
+        self.stats = Stats()
+        timer = DBTimer(self.functional.Test1.metadata.bind.dialect)
+        app = LoadMiddleware(twc.middleware.TwMiddleware(app),
+                             self.functional.session, self.stats, timer)
+        self.server = make_server('127.0.0.1', 0, app,
+                                  server_class=ThreadingWSGIServer,
+                                  handler_class=QuietHandler)
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        transaction.abort()
+        shutil.rmtree(self.directory)
+        tw2.core.core.request_local = self.request_local
+
+    def get_headers(self):
+        request = testing.DummyRequest(environ={'SERVER_NAME': 'servername'})
+        request.registry = self.registry
+        headers = remember(request, 'Bob')
+        return {'Cookie': headers[0][1].split(';')[0]}
+
+    def get_requests(self):
+        """The mixed read/write traffic: (path, POST data or None)
+        """
+        return [
+            ('/admin', None),
+            ('/admin/test1', None),
+            ('/admin/test1/new', None),
+            ('/admin/test1/1/edit', None),
+            ('/admin/test1/lookup?q=B', None),
+            ('/admin/test1/new', {'name': 'Fred'}),
+            ('/admin/test1/1/edit', {'name': 'Bob'}),
+        ]
+
+    def client(self, count, headers):
+        opener = urllib2.build_opener(NoRedirectHandler)
+        requests = self.get_requests()
+        for i in range(count):
+            path, data = random.choice(requests)
+            if data is not None:
+                data = urllib.urlencode(data)
+            request = urllib2.Request(self.url + path, data, headers)
+            start = time.time()
+            error = False
+            try:
+                opener.open(request).read()
+            except urllib2.HTTPError, e:
+                error = e.code >= 400
+            except urllib2.URLError:
+                error = True
+            self.stats.add(time.time() - start, error)
+
+    def run_load(self, threads, count):
+        headers = self.get_headers()
+        clients = [threading.Thread(target=self.client, args=(count, headers))
+                   for i in range(threads)]
+        start = time.time()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        return time.time() - start
+
+    def test_load(self):
+        count = int(os.environ.get('SQLADMIN_LOAD_REQUESTS', 50))
+        print
+        # lock err: the SQLite "database is locked" errors
+        # db: the time spent by a request in the database, lock waits included
+        print '%8s %10s %8s %8s %8s %10s %10s %10s %10s' % (
+            'threads', 'requests', 'req/s', 'errors', 'lock err',
+            'p50 (ms)', 'p95 (ms)', 'db p50', 'db p95')
+        for threads in get_thread_counts():
+            self.stats = stats = Stats()
+            self.server.get_app().stats = stats
+            duration = self.run_load(threads, count)
+            total = len(stats.durations)
+            print '%8d %10d %8.1f %8d %8d %10.1f %10.1f %10.1f %10.1f' % (
+                threads, total, total / duration, stats.errors,
+                stats.locked, percentile(stats.durations, 0.5) * 1000,
+                percentile(stats.durations, 0.95) * 1000,
+                percentile(stats.db_durations, 0.5) * 1000,
+                percentile(stats.db_durations, 0.95) * 1000)
+            self.assertEqual(total, threads * count)
+            # The only expected errors are the SQLite write locks
+            self.assertEqual(stats.errors, stats.locked)
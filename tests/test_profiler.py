@@ -0,0 +1,123 @@
+import unittest
+import cProfile
+import os
+import shutil
+import tempfile
+from pyramid import testing
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.response import Response
+import pyramid_sqladmin as pysqla
+import pyramid_sqladmin.profiler as profiler
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = pysqla.parse_settings({
+            'sqladmin.profile_dir': self.directory,
+            'sqladmin.profile_max_files': '2',
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_dummy_request(self, path='/admin', route_name='admin_list'):
+        request = testing.DummyRequest(path=path)
+        request.registry.settings = self.settings
+        request.matched_route = testing.DummyResource(name=route_name)
+        return request
+
+    def get_tween(self, **settings):
+        self.settings.update(settings)
+        registry = testing.DummyResource(settings=self.settings)
+        handler = lambda request: Response('ok')
+        return profiler.profiler_tween_factory(handler, registry)
+
+    def test_get_profiles(self):
+        self.assertEqual(profiler.get_profiles(self.directory), [])
+        self.assertEqual(
+            profiler.get_profiles(os.path.join(self.directory, 'unexisting')),
+            [])
+        for name in ['2.pstats', '1.pstats', 'other.txt']:
+            open(os.path.join(self.directory, name), 'w').close()
+        self.assertEqual(profiler.get_profiles(self.directory),
+                         ['1.pstats', '2.pstats'])
+
+    def test_save_profile(self):
+        directory = os.path.join(self.directory, 'profiles')
+        profile = cProfile.Profile()
+        profiler.save_profile(profile, directory, 2, '1.pstats')
+        profiler.save_profile(profile, directory, 2, '2.pstats')
+        self.assertEqual(profiler.get_profiles(directory),
+                         ['1.pstats', '2.pstats'])
+        profiler.save_profile(profile, directory, 2, '3.pstats')
+        self.assertEqual(profiler.get_profiles(directory),
+                         ['2.pstats', '3.pstats'])
+
+    def test_profiler_tween(self):
+        tween = self.get_tween()
+        response = tween(self.get_dummy_request())
+        self.assertEqual(response.body, 'ok')
+        self.assertEqual(profiler.get_profiles(self.directory), [])
+
+        tween = self.get_tween(**{'sqladmin.profile_sample_rate': 1.0})
+        tween(self.get_dummy_request(path='/other'))
+        tween(self.get_dummy_request(route_name='admin_lookup'))
+        self.assertEqual(profiler.get_profiles(self.directory), [])
+        response = tween(self.get_dummy_request())
+        self.assertEqual(response.body, 'ok')
+        profiles = profiler.get_profiles(self.directory)
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue('-admin_list-' in profiles[0])
+
+        tween = self.get_tween(**{
+            'sqladmin.profile_sample_rate': 0.0,
+            'sqladmin.profile_threshold': 3600.0})
+        tween(self.get_dummy_request())
+        self.assertEqual(len(profiler.get_profiles(self.directory)), 1)
+
+    def test_profiles_index(self):
+        for name in ['1.pstats', '2.pstats']:
+            open(os.path.join(self.directory, name), 'w').close()
+        request = self.get_dummy_request()
+        request.route_url = lambda *args, **kw: 'http://server/%s' % kw['filename']
+        response = profiler.profiles_index(request)
+        expected = {
+            'profiles': [('2.pstats', 'http://server/2.pstats'),
+                         ('1.pstats', 'http://server/1.pstats')]
+        }
+        self.assertEqual(response, expected)
+
+    def test_profile_download(self):
+        with open(os.path.join(self.directory, '1.pstats'), 'w') as f:
+            f.write('stats')
+        request = self.get_dummy_request()
+        request.matchdict['filename'] = '1.pstats'
+        response = profiler.profile_download(request)
+        self.assertEqual(response.content_type, 'application/octet-stream')
+        self.assertEqual(''.join(response.app_iter), 'stats')
+
+        request.matchdict['filename'] = '../1.pstats'
+        self.assertRaises(HTTPNotFound, profiler.profile_download, request)
+
+
+class IntegrationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp(settings={
+            'sqladmin.profile_dir': '/tmp/profiles'})
+        self.config.include('pyramid_sqladmin')
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def test_url(self):
+        request = testing.DummyRequest()
+        url = request.route_url('admin_profiles')
+        expected = 'http://example.com/admin/_profiles'
+        self.assertEqual(url, expected)
+
+        url = request.route_url('admin_profile', filename='1.pstats')
+        expected = 'http://example.com/admin/_profiles/1.pstats'
+        self.assertEqual(url, expected)
@@ -0,0 +1,219 @@
+import unittest
+import os
+import shutil
+import tempfile
+from webtest import TestApp
+from pyramid import testing
+from pyramid.request import Request
+from pyramid.response import Response
+from pyramid.security import remember
+import sqlalchemy as sa
+from sqlalchemy.orm import (
+    scoped_session,
+    sessionmaker,
+    clear_mappers,
+    )
+from zope.sqlalchemy import ZopeTransactionExtension
+from sqla_declarative.declarative import extended_declarative_base
+import transaction
+import tw2.core as twc
+import pyramid_sqladmin as pysqla
+import pyramid_sqladmin.readonly as readonly
+
+import test_init
+
+
+class TestReadOnly(unittest.TestCase):
+
+    def setUp(self):
+        clear_mappers()
+        pysqla.AVAILABLE_OBJECTS = pysqla._marker
+        self.session = scoped_session(sessionmaker(extension=ZopeTransactionExtension()))
+        Base = extended_declarative_base(
+            self.session,
+            metadata=sa.MetaData('sqlite:///:memory:'))
+
+        class Test1(Base):
+            id = sa.Column(sa.Integer, primary_key=True)
+            name = sa.Column(sa.String(50))
+
+        Base.metadata.create_all()
+        readonly.set_readonly_query_property(Test1)
+
+        self.Base = Base
+        self.Test1 = Test1
+        with transaction.manager:
+            self.session.add(Test1(name='Bob'))
+
+    def tearDown(self):
+        readonly.end_readonly()
+        transaction.abort()
+
+    def get_tween(self, **settings):
+        settings = pysqla.parse_settings(settings)
+        registry = testing.DummyResource(settings=settings)
+
+        def handler(request):
+            self.handled_session = self.Test1.query.session
+            return Response('ok')
+        self.handled_session = None
+        return readonly.readonly_tween_factory(handler, registry)
+
+    def test_set_readonly_query_property(self):
+        query_property = vars(self.Base)['query']
+        self.assertTrue(isinstance(query_property,
+                                   readonly.ReadOnlyQueryProperty))
+        # The query property is only wrapped once
+        readonly.set_readonly_query_property(self.Test1)
+        self.assertEqual(vars(self.Base)['query'], query_property)
+
+    def test_query_property(self):
+        self.assertEqual(self.Test1.query.session, self.session())
+
+        readonly.start_readonly()
+        session = self.Test1.query.session
+        self.assertTrue(isinstance(session, readonly.ReadOnlySession))
+        self.assertEqual(self.Test1.query.session, session)
+        self.assertEqual(self.Test1.query.one().name, 'Bob')
+        readonly.end_readonly()
+
+        self.assertEqual(self.Test1.query.session, self.session())
+
+    def test_set_read_only(self):
+        statements = []
+        connection = testing.DummyResource(
+            dialect=testing.DummyResource(name='postgresql'),
+            execute=statements.append)
+        readonly.set_read_only(None, None, connection)
+        self.assertEqual(statements, [
+            'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY'])
+
+    def test_query_only(self):
+        readonly.start_readonly()
+        session = self.Test1.query.session
+        self.assertEqual(self.Test1.query.one().name, 'Bob')
+        self.assertRaises(sa.exc.OperationalError, session.execute,
+                          "UPDATE test1 SET name = 'Fred'")
+        readonly.end_readonly()
+
+        # The writes are allowed again once the connection is released
+        with transaction.manager:
+            self.Test1.query.one().name = 'Fred'
+        self.assertEqual(self.Test1.query.one().name, 'Fred')
+
+    def test_readonly_tween(self):
+        tween = self.get_tween(**{'sqladmin.readonly_get': 'true'})
+        response = tween(testing.DummyRequest(path='/admin/test1'))
+        self.assertEqual(response.body, 'ok')
+        self.assertTrue(isinstance(self.handled_session,
+                                   readonly.ReadOnlySession))
+        self.assertEqual(self.Test1.query.session, self.session())
+
+        tween(testing.DummyRequest(path='/other'))
+        self.assertEqual(self.handled_session, self.session())
+
+        request = testing.DummyRequest(path='/admin/test1/new', post={})
+        tween(request)
+        self.assertEqual(self.handled_session, self.session())
+
+        tween = self.get_tween(**{'sqladmin.readonly': 'true'})
+        request = testing.DummyRequest(path='/admin/test1/new', post={})
+        response = tween(request)
+        self.assertEqual(response.status_int, 403)
+        self.assertEqual(self.handled_session, None)
+
+    def test_readonly_tween_stream(self):
+        def handler(request):
+            def app_iter():
+                yield str(self.Test1.query.session.__class__.__name__)
+            response = Response()
+            response.app_iter = app_iter()
+            return response
+
+        settings = pysqla.parse_settings({'sqladmin.readonly_get': 'true'})
+        registry = testing.DummyResource(settings=settings)
+        tween = readonly.readonly_tween_factory(handler, registry)
+        response = tween(testing.DummyRequest(path='/admin/test1'))
+        # The read-only session is kept until the end of the iteration
+        self.assertEqual(list(response.app_iter), ['ReadOnlySession'])
+        self.assertEqual(self.Test1.query.session, self.session())
+
+        # The read-only session is released when the body is closed without
+        # being iterated, like in a HEAD request
+        response = tween(testing.DummyRequest(path='/admin/test1'))
+        response.app_iter.close()
+        self.assertEqual(self.Test1.query.session, self.session())
+
+        # The read-only sessions left by a previous request are released
+        readonly.start_readonly()
+        session = self.Test1.query.session
+        self.get_tween()(testing.DummyRequest(path='/other'))
+        self.assertEqual(self.Test1.query.session, self.session())
+        self.assertEqual(len(session.identity_map), 0)
+
+
+class FunctionalTests(unittest.TestCase):
+
+    def setUp(self):
+        clear_mappers()
+        pysqla.AVAILABLE_OBJECTS = pysqla._marker
+        self.functional = test_init.FunctionalTests('test_home')
+
+    def tearDown(self):
+        readonly.end_readonly()
+        transaction.abort()
+
+    def get_app(self, settings, url='sqlite:///:memory:'):
+        app = self.functional.main(settings, url=url)
+        request = testing.DummyRequest(environ={'SERVER_NAME': 'servername'})
+        request.registry = app.registry
+        headers = remember(request, 'Bob')
+        self.headers = {'Cookie': headers[0][1].split(';')[0]}
+        return TestApp(twc.middleware.TwMiddleware(app))
+
+    def test_readonly_get(self):
+        testapp = self.get_app({'sqladmin.readonly_get': 'true'})
+        response = testapp.get('/admin/test1', headers=self.headers,
+                               status=200)
+        self.assertTrue('/admin/test1/1/edit' in response.body)
+        response = testapp.get('/admin/test1/1/edit', headers=self.headers,
+                               status=200)
+        self.assertTrue('value="Bob"' in response.body)
+        testapp.post('/admin/test1/1/edit', headers=self.headers,
+                     params={'name': 'Fred'}, status=302)
+        self.assertEqual(self.functional.Test1.query.one().name, 'Fred')
+
+    def test_readonly_get_stream_head(self):
+        testapp = self.get_app({'sqladmin.readonly_get': 'true',
+                                'sqladmin.stream_list': 'true'})
+        # Like a server answering a HEAD request, close the body without
+        # iterating it
+        request = Request.blank('/admin/test1', method='HEAD',
+                                headers=self.headers)
+        app_iter = testapp.app.app(request.environ, lambda *args: None)
+        app_iter.close()
+        testapp.post('/admin/test1/1/edit', headers=self.headers,
+                     params={'name': 'Fred'}, status=302)
+        query = self.functional.session.query(self.functional.Test1)
+        self.assertEqual(query.one().name, 'Fred')
+
+    def test_readonly(self):
+        testapp = self.get_app({'sqladmin.readonly': 'true'})
+        testapp.get('/admin/test1/1/edit', headers=self.headers, status=200)
+        testapp.post('/admin/test1/1/edit', headers=self.headers,
+                     params={'name': 'Fred'}, status=403)
+        self.assertEqual(self.functional.Test1.query.one().name, 'Bob')
+
+    def test_readonly_get_statement_timeout(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # The connections of a file database are closed when released
+        url = 'sqlite:///%s' % os.path.join(directory, 'admin.db')
+        testapp = self.get_app({'sqladmin.readonly_get': 'true',
+                                'sqladmin.statement_timeout': '5'}, url=url)
+        response = testapp.get('/admin/test1', headers=self.headers,
+                               status=200)
+        self.assertTrue('/admin/test1/1/edit' in response.body)
+        testapp.post('/admin/test1/1/edit', headers=self.headers,
+                     params={'name': 'Fred'}, status=302)
+        self.assertEqual(self.functional.Test1.query.one().name, 'Fred')